@@ -1,105 +1,204 @@
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_svg import FigureCanvasSVG
+from matplotlib.figure import Figure
+import numexpr as ne
 import numpy as np
-import pandas as pd
 import os
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-from data_manager import SymbolData
+from data_manager import CloseData, SymbolData
 from global_constants import HIST_DATA_YEARS
 
-def determine_exp_trend(data: pd.Series, 
-                                r2_threshold=0.8) -> tuple[bool, float, np.ndarray]:
-    """Use an exponential regression to determine if a series of data points in 
-    the form (x, y) follows a strong, positive exponential trend. (R^2 >= 0.8)
+# Spawning a chart worker costs about as much as rendering this many charts, so
+# smaller batches are rendered serially
+CHARTS_PER_WORKER = 25
+
+# The chart figure is created once per process and cleared between symbols
+_chart_figure = None
+_chart_axes = None
+
+@functools.lru_cache
+def _time_index(length: int) -> np.ndarray:
+    """Get the read-only time index (0, 1, ..., length - 1) used as the x 
+    values of the exponential regressions. Cached, since every symbol spanning
+    HIST_DATA_YEARS shares the same length.
+
+    Args:
+        length (int): The number of data points
+    Returns:
+        np.ndarray: The time index
+    """
+    time_index = np.arange(length, dtype=np.float32)
+    time_index.flags.writeable = False
+    return time_index
+
+def determine_exp_trends(prices_list: list[np.ndarray], r2_threshold=0.8
+                         ) -> list[tuple[bool, float, np.ndarray]]:
+    """Use exponential regressions to determine which of several series of
+    data points in the form (x, y) follow a strong, positive exponential trend.
+    (R^2 >= 0.8) The log of every series is stacked into a single 
+    (symbols, days) matrix so all of the regressions are fit at once with a 
+    handful of NumPy reductions. Series of different lengths are left-aligned
+    and masked. The matrix is single precision to halve its memory traffic, 
+    which is ample for close prices.
 
     Args:
-        data (pd.Series): The datestamped historical close data for a symbol.
+        prices_list (list[np.ndarray]): The historical close prices for each 
+        symbol, with no NaN values (as guaranteed by CloseData).
         r2_threshold (float, optional): The threshold of goodness of fit (R^2) 
         which must be met to consider the stock as following an exponential
-        grwoth trend.
-    
+        growth trend.
+
     Returns:
-        bool: Whether or not the symbol shows a historical exponential trend.
-        float: The R^2 value of the exponentnial regresion (if applicable)
-        np.ndarray: A series of values corresponding to each day of historical
-        close data containing the predicted price from the exponential 
-        regression.
+        list[tuple[bool, float, np.ndarray]]: For each series, in the same order
+        as prices_list: whether or not the symbol shows a historical 
+        exponential trend, the R^2 value of the exponential regression (if 
+        applicable), and the predicted price from the exponential regression 
+        for each day of historical close data (if applicable).
     """
-    data = data.dropna() # remove NaNs or missing values
-    time_index = np.arange(len(data)).reshape(-1, 1)
-    log_prices = np.log(data.values).reshape(-1, 1)
-    
-    model = LinearRegression()
-    model.fit(time_index, log_prices)
-    
-    # Use model to predict a value at each point
-    predicted_log_prices = model.predict(time_index)
-    # Create the LSRL and get an R^2
-    r2 = r2_score(log_prices, predicted_log_prices)
-    slope = model.coef_[0][0]  # Extract the slope from the model
-
-    if r2 >= r2_threshold and slope > 0:
-        predicted_prices = np.exp(predicted_log_prices)
-        return (True, r2, predicted_prices)
-    else:
-        return (False, None, None)
-
-def determine_cagr(data: pd.Series, years: float) -> float:
+    if not prices_list:
+        return []
+    lengths = np.array([prices.size for prices in prices_list], 
+                       dtype=np.float32)
+    time_index = _time_index(int(lengths.max()))
+    mask = time_index < lengths[:, None]
+
+    # Pad with 1.0 so the padding becomes 0 in log space
+    price_matrix = np.ones((len(prices_list), time_index.size), 
+                           dtype=np.float32)
+    for i, prices in enumerate(prices_list):
+        price_matrix[i, :prices.size] = prices
+    log_prices = ne.evaluate("log(price_matrix)")
+
+    # The x values are 0..n-1, so their mean and sum of squared deviations
+    # only depend on the series length
+    time_mean = (lengths - 1) / 2
+    time_ss = lengths * (lengths ** 2 - 1) / 12
+    time_dev = (time_index - time_mean[:, None]) * mask
+    log_mean = log_prices.sum(axis=1) / lengths
+    log_dev = (log_prices - log_mean[:, None]) * mask
+
+    slopes = (log_dev * time_dev).sum(axis=1) / time_ss
+    intercepts = log_mean - slopes * time_mean
+    predicted_log_prices = intercepts[:, None] + slopes[:, None] * time_index
+
+    ss_res = (((log_prices - predicted_log_prices) * mask) ** 2).sum(axis=1)
+    ss_tot = (log_dev ** 2).sum(axis=1)
+    r2s = 1 - ss_res / ss_tot
+
+    # Only convert the fits that pass back out of log space
+    passing = (r2s >= r2_threshold) & (slopes > 0)
+    passing_log_prices = predicted_log_prices[passing]
+    predicted_prices = iter(ne.evaluate("exp(passing_log_prices)"))
+
+    results = []
+    for i, prices in enumerate(prices_list):
+        if passing[i]:
+            results.append((True, float(r2s[i]), 
+                            next(predicted_prices)[:prices.size]))
+        else:
+            results.append((False, None, None))
+    return results
+
+def determine_cagr(prices: np.ndarray, years: float) -> float:
     """Determine the CAGR (cumulative average growth rate) of the symbol given
     its historical close data.
 
     Args:
-        data (pd.Series): The historical close data
+        prices (np.ndarray): The historical close prices
         years (float): The period of time spanned by the historical close data
     """
-    initial_price = data.iloc[0][0]
-    final_price = data.iloc[-1][0]
+    # Prices are stored in single precision, so do this math in double
+    initial_price = float(prices[0])
+    final_price = float(prices[-1])
     return (final_price / initial_price) ** (1/years) - 1
 
-def save_plot_img(data: dict, ticker_symbol: str, 
+def _init_chart_figure() -> None:
+    """Create the figure reused by save_plot_img in the current process. Drawn
+    with the SVG canvas directly rather than through pyplot, so no GUI backend
+    or global figure registry is involved. Used as the process pool 
+    initializer.
+    """
+    global _chart_figure, _chart_axes
+    _chart_figure = Figure(figsize=(10, 6))
+    FigureCanvasSVG(_chart_figure)
+    _chart_axes = _chart_figure.add_subplot()
+
+def save_plot_img(data: CloseData, ticker_symbol: str, 
                   predicted_prices: np.ndarray) -> str:
     """Save a MatPlotLib generated graph of the stock's historical performance
-    with an exponential trendline. Image saved as a PNG file for use in the PDF
-    report.
+    with an exponential trendline. Image saved as an SVG file to be embedded
+    in the PDF report.
     
     Args:
-        data (dict): The historical close data for the symbol.
+        data (CloseData): The historical close data for the symbol.
         ticker_symbol (str): The symbol.
         predicted_prices (str): The predicted prices corresponding to each
         value in data.
     """
-    chart_path = f"charts/{ticker_symbol}_chart.png"
+    chart_path = f"charts/{ticker_symbol}_chart.svg"
     os.makedirs('charts', exist_ok=True)
+    if _chart_figure is None:
+        _init_chart_figure()
     
-    plt.figure(figsize=(10, 6))
-    plt.title(ticker_symbol)
-    plt.plot(data.index, data.values, label='Actual Price')
-    plt.plot(data.index, predicted_prices, label='Exponential Trend Line', 
-             linestyle='--')
-    plt.xlabel("Date")
-    plt.ylabel("Adj. Close Price")
-    plt.legend()
-
-    plt.savefig(chart_path)
-    plt.close()
+    _chart_axes.clear()
+    _chart_axes.set_title(ticker_symbol)
+    _chart_axes.plot(data.dates, data.prices, label='Actual Price')
+    _chart_axes.plot(data.dates, predicted_prices, 
+                     label='Exponential Trend Line', linestyle='--')
+    _chart_axes.set_xlabel("Date")
+    _chart_axes.set_ylabel("Adj. Close Price")
+    _chart_axes.legend()
+
+    _chart_figure.canvas.print_figure(chart_path)
 
     return chart_path
 
+def _render_chart(args: tuple[CloseData, str, np.ndarray]) -> str:
+    """Unpack the arguments of save_plot_img so it can be mapped over a process
+    pool.
+
+    Args:
+        args (tuple[CloseData, str, np.ndarray]): The arguments to pass to 
+        save_plot_img
+    Returns:
+        str: The path of the saved chart
+    """
+    return save_plot_img(*args)
+
 def analyse_symbols(symbol_data_list: list[SymbolData]) -> None:
     """Perform data analysis on each of the SymbolData to determine if the stock
-    price exhibits an exponential trend.
+    price exhibits an exponential trend. The charts of the exponential symbols
+    are rendered in parallel on a process pool when there are enough of them
+    to pay for starting the workers.
 
     Args:
         symbol_data_list (list[SymbolData]): The list of SmybolData to analyze.
     """
-    for symbol_data in symbol_data_list:
-        is_exponential, r2, predicted_values = determine_exp_trend(
-            symbol_data.symbol_hist_data)
+    trends = determine_exp_trends(
+        [symbol_data.symbol_hist_data.prices 
+         for symbol_data in symbol_data_list])
+    chart_jobs = []
+    for symbol_data, trend in zip(symbol_data_list, trends):
+        is_exponential, r2, predicted_values = trend
         if is_exponential:
-            save_plot_img(symbol_data.symbol_hist_data, 
-                          symbol_data.symbol_info["symbol"],
-                          predicted_values)
+            chart_jobs.append((symbol_data.symbol_hist_data, 
+                               symbol_data.symbol_info["symbol"],
+                               predicted_values))
             symbol_data.r2 = r2
-            symbol_data.cagr = determine_cagr(symbol_data.symbol_hist_data, 
-                                              HIST_DATA_YEARS)
\ No newline at end of file
+            symbol_data.cagr = determine_cagr(
+                symbol_data.symbol_hist_data.prices, HIST_DATA_YEARS)
+    max_workers = min(len(chart_jobs) // CHARTS_PER_WORKER, 
+                      os.cpu_count() or 1)
+    if max_workers <= 1:
+        for chart_job in chart_jobs:
+            _render_chart(chart_job)
+        return
+    # Spawn the workers rather than forking this process, which is already
+    # running numexpr's thread pool
+    with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_chart_figure) as executor:
+        list(executor.map(_render_chart, chart_jobs))
@@ -1,147 +1,495 @@
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
 import yfinance as yf
-import pickle
+from yfinance.exceptions import YFRateLimitError
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from time import sleep
+from typing import Callable, TypeVar
 
 import finnhub_client
 from global_constants import HIST_DATA_YEARS
 
-@dataclass
+@dataclass(slots=True)
+class CloseData:
+    """Dataclass containing the historical close data for a stock symbol as
+    bare NumPy arrays, so the analysis never goes through pandas indexing.
+
+    Attributes:
+        dates (np.ndarray): The date of each close price (datetime64)
+        prices (np.ndarray): The close prices (float32), with no NaN values
+    """
+    dates: np.ndarray
+    prices: np.ndarray
+
+    @classmethod
+    def from_series(cls, series: pd.Series) -> "CloseData":
+        """Build a CloseData from a date indexed series of close prices.
+
+        Args:
+            series (pd.Series): The date indexed close prices
+        Returns:
+            CloseData: The close data, with any NaN values removed
+        """
+        series = series.dropna()
+        return cls(series.index.to_numpy(), 
+                   series.to_numpy(dtype=np.float32))
+
+    def to_series(self) -> pd.Series:
+        """Convert the close data back into a date indexed series.
+
+        Returns:
+            pd.Series: The date indexed close prices
+        """
+        return pd.Series(self.prices, index=pd.DatetimeIndex(self.dates))
+
+@dataclass(slots=True)
 class SymbolData:
     """Dataclass containing the info and statistics, historical data, and 
     exponential fit results for a stock symbol.
     
     Attributes:
         symbol_info (dict): Basic info about the company behind the stock symbol
-        symbol_hist_data (dict): Historical close data for the stock symbol
+        symbol_hist_data (CloseData): Historical close data for the stock symbol
         r2 (float): R^2 value (goodness of fit) of the exponential regression
         performed on the model
         cagr (float): The CAGR (Cumulative Average Growth Rate) of the company's
         stock price. The avaerage % change in the stock price each year.
     """
     symbol_info: dict
-    symbol_hist_data: dict
+    symbol_hist_data: CloseData
     r2: float
     cagr: float
 
-CACHE_FILENAME = "cache.pkl"
-REQUEST_DELAY = 2
+CACHE_HIST_FILENAME = "cache/symbols_hist.parquet"
+CACHE_INFO_FILENAME = "cache/symbols_info.json"
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 2 # seconds, doubled after each rate limited attempt
+HIST_CACHE_DIR = "cache/hist"
+INFO_CACHE_DIR = "cache/info"
+INFO_CACHE_MAX_AGE = 24 * 60 * 60 # seconds
+ADJUSTMENT_TOLERANCE = 1e-4 # relative change that marks cached history stale
 
 def cache_symbol_data(symbol_data_list: list[SymbolData]) -> None:
-    """Write a list of SymbolData to a file in the user's system to save data
-    for future use. 
+    """Write a list of SymbolData to files in the user's system to save data
+    for future use. The historical close data is saved as a zstd compressed 
+    Parquet file with one column per symbol, and the symbol info as JSON.
     
     Args: 
         symbol_data_list (list[SymbolData]): The list of SymbolData to save
     Returns:
         None
     """
-    with open(CACHE_FILENAME, "wb") as file:
-        pickle.dump(symbol_data_list, file)
+    os.makedirs(os.path.dirname(CACHE_HIST_FILENAME), exist_ok=True)
+    hist_frame = pd.DataFrame({
+        symbol_data.symbol_info["symbol"]: 
+        symbol_data.symbol_hist_data.to_series()
+        for symbol_data in symbol_data_list})
+    hist_frame.to_parquet(CACHE_HIST_FILENAME, engine="pyarrow", 
+                          compression="zstd")
+    with open(CACHE_INFO_FILENAME, "w") as file:
+        json.dump([symbol_data.symbol_info for symbol_data in symbol_data_list],
+                  file, default=str)
 
 def load_cached_symbol_data() -> list[SymbolData]:
-    """Load the previously written SymbolData in the cache file, located at a
-    hard-coded path.
+    """Load the previously written SymbolData in the cache files, located at
+    hard-coded paths.
 
     Args: 
         None
     Returns:
-        list[SymbolData]: The list of SymbolData from the cache file
+        list[SymbolData]: The list of SymbolData from the cache files
+    """
+    hist_frame = pd.read_parquet(CACHE_HIST_FILENAME, engine="pyarrow")
+    with open(CACHE_INFO_FILENAME) as file:
+        symbol_infos = json.load(file)
+    # Symbols share the frame's date index, so drop each column's padding NaNs
+    return [SymbolData(symbol_info, 
+                       CloseData.from_series(hist_frame[symbol_info["symbol"]]),
+                       0., 0.)
+            for symbol_info in symbol_infos]
+
+# Time (time.monotonic) until which all threads hold off on Yahoo Finance
+# requests after one of them was rate limited
+_rate_limited_until = 0.0
+_rate_limit_lock = threading.Lock()
+
+T = TypeVar("T")
+
+def _call_with_backoff(request: Callable[[], T]) -> T:
+    """Call a Yahoo Finance request, retrying with exponential backoff while it
+    is rate limited. The backoff is shared by all threads, so one rate limited
+    request pauses every worker instead of letting the others keep hitting the
+    limit.
+
+    Args:
+        request (Callable[[], T]): The function making the request
+    Returns:
+        T: The return value of request
+    Raises:
+        YFRateLimitError: If the request is still rate limited after 
+        MAX_RETRIES attempts
+    """
+    global _rate_limited_until
+    for attempt in range(MAX_RETRIES):
+        with _rate_limit_lock:
+            delay = _rate_limited_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            return request()
+        except YFRateLimitError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            with _rate_limit_lock:
+                _rate_limited_until = max(
+                    _rate_limited_until, 
+                    time.monotonic() + BACKOFF_BASE * 2 ** attempt)
+
+def _read_cached_info(ticker_symbol: str) -> dict | None:
+    """Read the cached info of a symbol if it is younger than 
+    INFO_CACHE_MAX_AGE seconds.
+
+    Args:
+        ticker_symbol (str): The symbol to read the info of
+    Returns:
+        dict | None: The cached info, or None if there is no fresh cache entry
     """
-    with open(CACHE_FILENAME, "rb") as file:
-        return pickle.load(file)
+    info_path = f"{INFO_CACHE_DIR}/{ticker_symbol}.json"
+    if (os.path.exists(info_path) and 
+            time.time() - os.path.getmtime(info_path) < INFO_CACHE_MAX_AGE):
+        with open(info_path) as file:
+            return json.load(file)
+    return None
 
-def validate_and_get_info(ticker_symbol: str) -> tuple[bool, yf.Ticker]:
+def validate_symbol(ticker_symbol: str) -> bool:
     """Lookup a ticker symbol using the Yahoo Finance scraping library to
     determine if the symbol is currently listed and trading on the market 
-    (valid). If the symbol is valid, return a yf.Ticker object for further
-    data collection.
+    (valid) from its last day of price history. The full company info is not
+    requested here (see get_symbol_info), and symbols with freshly cached info
+    are considered valid without a request.
 
     Args:
         ticker_symbol (str): The symbol to validate
     Returns:
-        tuple[bool, yf.Ticker | None]: A tuple containing a boolean representing 
-        if the stock is valid or not, and either a yf.Ticker for the valid 
-        symbol or None.
+        bool: Whether or not the symbol is valid
     """
+    if _read_cached_info(ticker_symbol) is not None:
+        return True
     try:
         ticker = yf.Ticker(ticker_symbol)
-        sleep(REQUEST_DELAY)
-        data = ticker.history(period="1d")
-        if data.empty:
-            print(f"""{ticker_symbol}: No price history available. 
-                  Invalid or delisted ticker.""")
-            return (False, None)
-        return (True, ticker.get_info())
+        data = _call_with_backoff(lambda: ticker.history(period="1d"))
+    except YFRateLimitError:
+        print(f"{ticker_symbol}: Still rate limited after {MAX_RETRIES} "
+              "attempts, skipping.")
+        return False
     except Exception as e:
         print(f"{ticker_symbol}: Validation failed due to error: {e}")
-        return (False, None)
+        return False
+    if data.empty:
+        print(f"""{ticker_symbol}: No price history available. 
+              Invalid or delisted ticker.""")
+        return False
+    return True
 
-def get_historical_close_data(ticker_symbol: str, 
-                              period_years=HIST_DATA_YEARS) -> dict | None:
-    """Get the historical close data for a stock symbol over a default period
-    of 5 years using the Yahoo Finance scraper.
+def get_symbol_info(ticker_symbol: str) -> dict | None:
+    """Get the basic info about the company behind a valid stock symbol using 
+    the Yahoo Finance scraping library. The info is cached in INFO_CACHE_DIR 
+    for up to INFO_CACHE_MAX_AGE seconds.
+
+    Args:
+        ticker_symbol (str): The symbol to get the info of
+    Returns:
+        dict | None: The info about the symbol, or None if the lookup failed
+    """
+    symbol_info = _read_cached_info(ticker_symbol)
+    if symbol_info is not None:
+        return symbol_info
+    try:
+        symbol_info = _call_with_backoff(yf.Ticker(ticker_symbol).get_info)
+    except Exception as e:
+        print(f"{ticker_symbol}: Info lookup failed due to error: {e}")
+        return None
+    os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+    with open(f"{INFO_CACHE_DIR}/{ticker_symbol}.json", "w") as file:
+        json.dump(symbol_info, file, default=str)
+    return symbol_info
+
+def _select_close_column(symbol_data: pd.DataFrame) -> pd.Series:
+    """Pick the close prices out of a symbol's Yahoo Finance price history, 
+    preferring the adjusted close.
+
+    Args:
+        symbol_data (pd.DataFrame): The price history of one symbol
+    Returns:
+        pd.Series: The close prices (float32), with no NaN values
+    """
+    price_column = ("Adj Close" if "Adj Close" in symbol_data.columns 
+                    else "Close")
+    return symbol_data[price_column].dropna().astype(np.float32)
+
+def _download_symbol_close_data(ticker_symbol: str, start: str, 
+                                end: str) -> pd.Series:
+    """Download the close data for a single stock symbol between two dates,
+    backing off while Yahoo Finance is rate limiting.
 
     Args:
         ticker_symbol (str): The ticker symbol to retrieve data for
+        start (str): The first date to retrieve data for (YYYY-MM-DD)
+        end (str): The date to retrieve data up to, exclusive (YYYY-MM-DD)
+    Returns:
+        pd.Series: The close data, empty if Yahoo Finance has none
+    Raises:
+        YFRateLimitError: If the request is still rate limited after 
+        MAX_RETRIES attempts
+    """
+    ticker = yf.Ticker(ticker_symbol)
+    data = _call_with_backoff(
+        lambda: ticker.history(start=start, end=end, auto_adjust=False))
+    if data.empty:
+        return pd.Series(dtype=np.float32)
+    # Match the timezone-naive dates of yf.download and the cache
+    data.index = data.index.tz_localize(None)
+    return _select_close_column(data)
+
+def _download_close_data(ticker_symbols: list[str], start: str, 
+                         end: str) -> dict[str, pd.Series]:
+    """Download the close data for several stock symbols between two dates 
+    with a single Yahoo Finance bulk download. yf.download swallows per-symbol
+    errors, including rate limits, so symbols missing from the result are 
+    retried one by one with backoff to tell failed downloads apart from
+    symbols that have no data.
+
+    Args:
+        ticker_symbols (list[str]): The ticker symbols to retrieve data for
+        start (str): The first date to retrieve data for (YYYY-MM-DD)
+        end (str): The date to retrieve data up to, exclusive (YYYY-MM-DD)
+    Returns:
+        dict[str, pd.Series]: The close data for each symbol that Yahoo Finance
+        returned data for
+    """
+    try:
+        data = yf.download(" ".join(ticker_symbols), start=start, end=end,
+                           group_by="ticker", threads=MAX_WORKERS, 
+                           auto_adjust=False)
+    except Exception as e:
+        print(f"Error fetching data for {ticker_symbols}: {e}")
+        data = pd.DataFrame()
+
+    close_data = {}
+    missing_symbols = []
+    for ticker_symbol in ticker_symbols:
+        if data.empty:
+            symbol_close_data = None
+        elif data.columns.nlevels == 1:
+            # Single symbol downloads may come back without the ticker level
+            symbol_close_data = _select_close_column(data)
+        elif ticker_symbol in data.columns.get_level_values(0):
+            # The bulk frame shares one date index, so drop the padding NaNs
+            symbol_close_data = _select_close_column(data[ticker_symbol])
+        else:
+            symbol_close_data = None
+        if symbol_close_data is not None and not symbol_close_data.empty:
+            close_data[ticker_symbol] = symbol_close_data
+        else:
+            missing_symbols.append(ticker_symbol)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(_download_symbol_close_data, ticker_symbol,
+                                   start, end): ticker_symbol 
+                   for ticker_symbol in missing_symbols}
+        for future, ticker_symbol in futures.items():
+            try:
+                symbol_close_data = future.result()
+            except YFRateLimitError:
+                print(f"{ticker_symbol}: Download still rate limited after "
+                      f"{MAX_RETRIES} attempts, skipping.")
+                continue
+            except Exception as e:
+                print(f"Error fetching data for {ticker_symbol}: {e}")
+                continue
+            if not symbol_close_data.empty:
+                close_data[ticker_symbol] = symbol_close_data
+    return close_data
+
+def get_bulk_historical_close_data(ticker_symbols: list[str], 
+                                   period_years=HIST_DATA_YEARS
+                                   ) -> dict[str, CloseData]:
+    """Get the historical close data for several stock symbols over a default
+    period of 5 years. Previously downloaded data is read from the on-disk 
+    cache in HIST_CACHE_DIR, and only the missing days (plus one overlapping
+    day used to detect splits and dividends) are downloaded from Yahoo 
+    Finance, batching symbols into as few requests as possible.
+
+    Args:
+        ticker_symbols (list[str]): The ticker symbols to retrieve data for
         period_years (int, optional): The length of the period to retrieve 
         historical close data from
     Returns:
-        dict | None: A dictionary containing the historical close data
+        dict[str, CloseData]: The historical close data for each symbol that
+        Yahoo Finance returned data for
     """
+    if not ticker_symbols:
+        return {}
     today = datetime.now().date()
     five_years_ago = today - relativedelta(years=period_years)
 
     today_formatted = today.strftime("%Y-%m-%d")    
     five_years_ago_formatted = five_years_ago.strftime("%Y-%m-%d")   
 
-    try:
-        data = yf.download(ticker_symbol, start=five_years_ago_formatted, 
-                           end=today_formatted)
-        sleep(REQUEST_DELAY)
-        if data.empty:
-            raise ValueError(f"No data found for symbol: {ticker_symbol}")
-            return None
-        price_column = "Adj Close" if "Adj Close" in data.columns else "Close"
-        return data[price_column]
-    except Exception as e:
-        print(f"Error fetching data for {ticker_symbol}: {e}")
+    # Only download the days after the last cached day, plus that day itself.
+    # Adjusted close data is rewritten by Yahoo Finance after every split or
+    # dividend, so if the overlapping day no longer matches the cached value
+    # the cached series is stale and is downloaded again in full.
+    cached_data = {}
+    symbols_by_start = {}
+    for ticker_symbol in ticker_symbols:
+        start = five_years_ago_formatted
+        hist_path = f"{HIST_CACHE_DIR}/{ticker_symbol}.parquet"
+        if os.path.exists(hist_path):
+            symbol_cached_data = pd.read_parquet(hist_path)["close"]
+            if not symbol_cached_data.empty:
+                cached_data[ticker_symbol] = symbol_cached_data
+                last_day = symbol_cached_data.index.max().strftime("%Y-%m-%d")
+                start = max(start, last_day)
+        symbols_by_start.setdefault(start, []).append(ticker_symbol)
+
+    new_data = {}
+    for start, start_symbols in symbols_by_start.items():
+        new_data.update(_download_close_data(start_symbols, start, 
+                                             today_formatted))
+
+    stale_symbols = []
+    for ticker_symbol, symbol_cached_data in cached_data.items():
+        if ticker_symbol not in new_data:
+            continue
+        last_day = symbol_cached_data.index.max()
+        symbol_new_data = new_data[ticker_symbol]
+        if (last_day not in symbol_new_data.index or 
+                not np.isclose(symbol_new_data[last_day], 
+                               symbol_cached_data[last_day], 
+                               rtol=ADJUSTMENT_TOLERANCE)):
+            stale_symbols.append(ticker_symbol)
+    if stale_symbols:
+        for ticker_symbol in stale_symbols:
+            del cached_data[ticker_symbol]
+            new_data.pop(ticker_symbol)
+        new_data.update(_download_close_data(
+            stale_symbols, five_years_ago_formatted, today_formatted))
+
+    os.makedirs(HIST_CACHE_DIR, exist_ok=True)
+    hist_data = {}
+    for ticker_symbol in ticker_symbols:
+        parts = [data[ticker_symbol] for data in (cached_data, new_data)
+                 if ticker_symbol in data]
+        if not parts:
+            continue
+        close_data = pd.concat(parts).astype(np.float32)
+        # The overlapping day appears in both parts
+        close_data = close_data[~close_data.index.duplicated(keep="last")]
+        if ticker_symbol in new_data:
+            close_data.to_frame("close").to_parquet(
+                f"{HIST_CACHE_DIR}/{ticker_symbol}.parquet", engine="pyarrow")
+        close_data = close_data[close_data.index >= five_years_ago_formatted]
+        if not close_data.empty:
+            hist_data[ticker_symbol] = CloseData.from_series(close_data)
+    return hist_data
+
+def get_historical_close_data(ticker_symbol: str, 
+                              period_years=HIST_DATA_YEARS) -> CloseData | None:
+    """Get the historical close data for a stock symbol over a default period
+    of 5 years using the Yahoo Finance scraper.
+
+    Args:
+        ticker_symbol (str): The ticker symbol to retrieve data for
+        period_years (int, optional): The length of the period to retrieve 
+        historical close data from
+    Returns:
+        CloseData | None: The historical close data
+    """
+    hist_data = get_bulk_historical_close_data([ticker_symbol], period_years)
+    if ticker_symbol not in hist_data:
+        print(f"No data found for symbol: {ticker_symbol}")
         return None
+    return hist_data[ticker_symbol]
+
+def validate_symbols(symbol_strings: list[str], 
+                     num_symbols: int) -> list[str]:
+    """Validate symbols concurrently on a pool of MAX_WORKERS threads until 
+    num_symbols valid symbols have been found. At most 2 * MAX_WORKERS 
+    validations are queued at a time, so no work is queued for symbols that 
+    are never needed.
+
+    Args:
+        symbol_strings (list[str]): The ticker symbols to validate
+        num_symbols (int): The number of valid symbols to find before 
+        returning.
+    Returns:
+        list[str]: The valid symbols
+    """
+    valid_symbols = []
+    if num_symbols <= 0:
+        return valid_symbols
+    remaining_symbols = iter(symbol_strings)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = {}
+        while len(valid_symbols) < num_symbols:
+            for symbol_string in remaining_symbols:
+                pending[executor.submit(validate_symbol, symbol_string)] = (
+                    symbol_string)
+                if len(pending) == 2 * MAX_WORKERS:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                symbol_string = pending.pop(future)
+                if future.result() and len(valid_symbols) < num_symbols:
+                    valid_symbols.append(symbol_string)
+        # Drop the queued validations that have not started yet
+        executor.shutdown(cancel_futures=True)
+    return valid_symbols
 
 def get_and_cache_data(num_symbols: int) -> list[SymbolData]:
     """Search for, retrieve, and cache data on stock symbols from the random
-    list given by the Finnhub API. Search through a maximum of num_symbols
-    symbols, validating each one. The number of valid symbols and therefore
-    length of the return list is not gaurenteed, dependent on the number of
-    valid symbols.
+    list given by the Finnhub API. Symbols are validated concurrently until
+    num_symbols valid symbols have been found, then the historical close data
+    for all of them is retrieved in one bulk download. The full company info 
+    is only looked up for the symbols that have historical data. The number of
+    valid symbols and therefore length of the return list is not gaurenteed, 
+    dependent on the number of valid symbols.
 
     Args:
-        num_symbols (int): The number of symbols to search through before 
+        num_symbols (int): The number of valid symbols to find before 
         returning.
     Returns:
         list[SymbolData]: A list of SymbolData for each valid stock symbol that
         was found
     """
     symbols = finnhub_client.get_symbols()
+    valid_symbols = validate_symbols(
+        [symbol["displaySymbol"] for symbol in symbols], num_symbols)
+    hist_data = get_bulk_historical_close_data(valid_symbols)
+    for symbol_string in valid_symbols:
+        if symbol_string not in hist_data:
+            print(f"No historical data retrieved for symbol: {symbol_string}.")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        symbol_infos = dict(zip(hist_data, 
+                                executor.map(get_symbol_info, hist_data)))
+
     symbol_data_list = []
-    i = 0
-    for symbol in symbols:
-        if i == num_symbols:
-            break
-        symbol_string = symbol["displaySymbol"]
-        is_valid, symbol_info = validate_and_get_info(symbol_string)
-        if is_valid:
-            hist_data = get_historical_close_data(symbol_string)
-            if hist_data is not None:
-                symbol_data = SymbolData(symbol_info, hist_data, 0., 0.)
-                symbol_data_list.append(symbol_data)
-                i += 1
-            else:
-                print(f"Yahoo Finance has no data for symbol: {symbol_string}.")
-        else:
-            print(f"Symbol {symbol_string} is invalid or delisted.")
+    for symbol_string, symbol_info in symbol_infos.items():
+        if symbol_info is not None:
+            symbol_data = SymbolData(symbol_info, hist_data[symbol_string], 
+                                     0., 0.)
+            symbol_data_list.append(symbol_data)
 
     cache_symbol_data(symbol_data_list)
     return symbol_data_list
@@ -149,7 +497,8 @@ def get_and_cache_data(num_symbols: int) -> list[SymbolData]:
 def get_symbol_data(read_from_cache: bool, num_symbols: int) -> list[SymbolData]:
     """Get data on stock symbols, either by searching through a maximum of 
     num_symbols symbols using the Finnhub API and Yahoo Finance scraper or by
-    reading the cache file.
+    reading the cache files. If the cache files do not exist yet (including
+    caches written as cache.pkl by older versions), new symbols are looked up.
 
     Args:
         read_from_cache (bool): Whether to read from cache or to lookup a new
@@ -158,5 +507,8 @@ def get_symbol_data(read_from_cache: bool, num_symbols: int) -> list[SymbolData]
         before stopping the stock symbol lookup process. 
     """
     if read_from_cache:
-        return load_cached_symbol_data()
+        if (os.path.exists(CACHE_HIST_FILENAME) and 
+                os.path.exists(CACHE_INFO_FILENAME)):
+            return load_cached_symbol_data()
+        print("No symbol data cache found. Looking up new symbols.")
     return get_and_cache_data(num_symbols)
\ No newline at end of file
@@ -1,9 +1,36 @@
 import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+import functools
 import os
+import string
 
 from formatting import *
 from data_manager import SymbolData
 
+@functools.lru_cache
+def _load_html_template() -> string.Template:
+    """Read the report template on first use and reuse it for every page.
+
+    Returns:
+        string.Template: The template for a stock's pages of the report
+    """
+    with open("template.html") as file:
+        return string.Template(file.read())
+
+@functools.lru_cache
+def _load_stylesheet() -> tuple[weasyprint.CSS, FontConfiguration]:
+    """Parse the report stylesheet on first use, with a font configuration
+    shared by every render so fonts are only loaded and shaped once. Loaded
+    lazily so importing this module (e.g. in a chart worker) stays cheap.
+
+    Returns:
+        tuple[weasyprint.CSS, FontConfiguration]: The parsed stylesheet and
+        the font configuration it was parsed with
+    """
+    font_config = FontConfiguration()
+    return (weasyprint.CSS(filename="styles.css", font_config=font_config), 
+            font_config)
+
 def generate_stock_html(ticker_info: dict, r2: float, cagr: float) -> str:
     """Generate a string of HTML representing pages of the PDF report for a 
     stock symbol using template.html,styles.css, and the provided arguments. 
@@ -21,28 +48,25 @@ def generate_stock_html(ticker_info: dict, r2: float, cagr: float) -> str:
     mkt_cap_formatted = format_money(ticker_info["marketCap"])
     todays_date_formatted = format_today()
     ticker_symbol = ticker_info["symbol"]
-    chart_path = f"charts/{ticker_symbol}_chart.png"
-    with open("template.html") as file:
-        html_template = file.read()
-
-    html_content = html_template.replace("{{ ticker_symbol }}", ticker_symbol)
-    html_content = html_content.replace("{{ longName }}", 
-                                        ticker_info["longName"])
-    html_content = html_content.replace("{{ mkt_cap_formatted }}", 
-                                        mkt_cap_formatted)
-    html_content = html_content.replace("{{ longBusinessSummary }}",
-                                        ticker_info["longBusinessSummary"])
-    html_content = html_content.replace("{{ cagr }}", f"{cagr:.2%}")
-    html_content = html_content.replace("{{ r2 }}", f"{r2:.3f}")
-    html_content = html_content.replace("{{ todays_date }}",
-                                        todays_date_formatted)
-    html_content = html_content.replace("{{ full_address }}", format_address(
-        ticker_info.get("address1"), ticker_info.get("address2"), 
-        ticker_info.get("city"), ticker_info.get("state"),
-        ticker_info.get("zip"), ticker_info.get("country")
-    ))
-    html_content = html_content.replace("{{ chart_path }}", 
-                                        f"file://{os.path.abspath(chart_path)}")
+    chart_path = f"charts/{ticker_symbol}_chart.svg"
+    with open(chart_path) as file:
+        chart_svg = file.read()
+    # Inline the chart, dropping the XML prolog that is invalid inside HTML
+    chart_svg = chart_svg[chart_svg.index("<svg"):]
+    html_content = _load_html_template().substitute(
+        ticker_symbol=ticker_symbol,
+        longName=ticker_info["longName"],
+        mkt_cap_formatted=mkt_cap_formatted,
+        longBusinessSummary=ticker_info["longBusinessSummary"],
+        cagr=f"{cagr:.2%}",
+        r2=f"{r2:.3f}",
+        todays_date=todays_date_formatted,
+        full_address=format_address(
+            ticker_info.get("address1"), ticker_info.get("address2"), 
+            ticker_info.get("city"), ticker_info.get("state"),
+            ticker_info.get("zip"), ticker_info.get("country")),
+        chart_svg=chart_svg
+    )
     return html_content
 
 def generate_report(symbol_data_list: list[SymbolData]) -> None:
@@ -57,15 +81,17 @@ def generate_report(symbol_data_list: list[SymbolData]) -> None:
     """
     os.makedirs("reports", exist_ok=True)
     report_path = f"reports/{current_time()}.pdf" 
-    report_html = ""
+    report_parts = []
     page_count = len(symbol_data_list)
     for i, symbol_data in enumerate(symbol_data_list, start=1):
         if symbol_data.r2 != 0.0:
             symbol_html = generate_stock_html(symbol_data.symbol_info, 
                                               symbol_data.r2, symbol_data.cagr)
-            report_html += symbol_html
+            report_parts.append(symbol_html)
+    report_html = "".join(report_parts)
     html = weasyprint.HTML(string=report_html)
-    css = weasyprint.CSS(filename="styles.css")
-    html.write_pdf(report_path, stylesheets=[css])
+    stylesheet, font_config = _load_stylesheet()
+    html.write_pdf(report_path, stylesheets=[stylesheet], 
+                   font_config=font_config)
     print(f"PDF report saved to {report_path}")
         
\ No newline at end of file